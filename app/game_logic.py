@@ -1,7 +1,8 @@
 import secrets
 import logging
-from typing import Optional, Dict, Any, List
-from app.models import GameSession, Player, Piece, PieceStatus, GameStatus
+from collections import deque
+from typing import Optional, Dict, Any, List, NamedTuple
+from app.models import GameSession, Player, Piece, PieceStatus, GameStatus, STATUS_NAMES
 
 logger = logging.getLogger(__name__)
 
@@ -39,30 +40,31 @@ def initialize_game(session: GameSession) -> None:
         raise ValueError("Maximálně 4 hráči")
     
     # Přiřadí barvy a startovní pozice hráčům
-    available_colors = session.COLORS.copy()
+    session.track_occupancy = {}
+    session.lane_occupancy = {}
+    # Volné barvy pro hráče bez barvy - obsazené se přeskočí, aby nevznikly duplicity
+    used_colors = session.used_colors()
+    available_colors = deque(c for c in session.COLORS if c not in used_colors)
     
     for i, player in enumerate(session.players):
         # Pokud hráč nemá barvu, přiřadí se automaticky
         if not player.color:
             if available_colors:
-                player.color = available_colors.pop(0)
+                session.set_player_color(player, available_colors.popleft())
         
         # Nastav startovní pozici podle barvy
         if player.color in START_INDEX:
             player.start_position = START_INDEX[player.color]
+            player.entry_position = ENTRY_INDEX[player.color]
         
         # Resetuje figurky a statistiky
-        for piece in player.pieces:
-            piece.status = PieceStatus.HOME
-            piece.position = piece.home_position  # home slot (0-3)
-        player.stats_turns = 0
-        player.stats_deployments = 0
-        player.stats_moves = 0
-        player.stats_captures = 0
-        player.stats_sixes = 0
+        player.reset_pieces()
+        player.reset_stats()
     
+    session.bump()
     session.status = GameStatus.PLAYING
-    session.current_player_id = session.players[0].player_id
+    session.index_players()
+    session.set_current_player(session.players[0].player_id)
     session.can_roll_dice = True
     session.last_dice_roll = 0
     # Inicializace počítadla pro první nasazení (3 pokusy pro každého hráče)
@@ -74,53 +76,92 @@ def roll_dice() -> int:
     return secrets.randbelow(6) + 1
 
 
-def get_piece_at_position(session: GameSession, color: str, state: str, position: int) -> Optional[Piece]:
-    """Najde figuru na dané pozici (track nebo lane)"""
-    for player in session.players:
-        if player.color == color:
-            continue  # Vlastní figurky kontrolujeme jinde
-        for piece in player.pieces:
-            if piece.status.value == state and piece.position == position:
-                return piece
+def _clear_position(session: GameSession, player: Player, piece: Piece) -> None:
+    """Odebere figurku z indexu obsazenosti a zvýší verzi stavu"""
+    session.bump()
+    if piece.status == PieceStatus.TRACK:
+        session.track_occupancy.pop(piece.position, None)
+        player.own_track_mask &= ~(1 << piece.position)
+        player.on_board_count -= 1
+    elif piece.status == PieceStatus.HOME_LANE:
+        session.lane_occupancy.pop((player.color, piece.position), None)
+        player.own_lane_mask &= ~(1 << piece.position)
+        player.on_board_count -= 1
+
+
+def _set_track(session: GameSession, player: Player, piece: Piece, position: int) -> None:
+    """Přesune figurku na track a aktualizuje index"""
+    _clear_position(session, player, piece)
+    piece.status = PieceStatus.TRACK
+    piece.position = position
+    session.track_occupancy[position] = piece
+    player.own_track_mask |= 1 << position
+    player.on_board_count += 1
+
+
+def _set_lane(session: GameSession, player: Player, piece: Piece, lane_pos: int) -> None:
+    """Přesune figurku do cílové dráhy a aktualizuje index"""
+    _clear_position(session, player, piece)
+    piece.status = PieceStatus.HOME_LANE
+    piece.position = lane_pos
+    session.lane_occupancy[(player.color, lane_pos)] = piece
+    player.own_lane_mask |= 1 << lane_pos
+    player.on_board_count += 1
+
+
+def _set_finished(session: GameSession, player: Player, piece: Piece) -> None:
+    """Přesune figurku do cíle"""
+    _clear_position(session, player, piece)
+    piece.status = PieceStatus.FINISHED
+    piece.position = None
+    player.finished_count += 1
+
+
+def _find_opponent_on_track(session: GameSession, player: Player, position: int) -> Optional[Piece]:
+    """Najde figurku soupeře na track pozici"""
+    piece = session.track_occupancy.get(position)
+    if piece and piece.player_id != player.player_id:
+        return piece
     return None
 
 
-def get_own_piece_at_position(player: Player, state: str, position: int) -> Optional[Piece]:
+def _capture(session: GameSession, captured: Piece, capturer: Player, result: Dict[str, Any]) -> None:
+    """Vyhodí figurku soupeře na její home slot a doplní výsledek tahu"""
+    position = captured.position
+    # Uvolní track políčko (index, maska i počet figurek vlastníka) a vrátí figurku domů
+    _clear_position(session, session.get_player(captured.player_id), captured)
+    captured.status = PieceStatus.HOME
+    captured.position = captured.home_position
+    capturer.stats_captures += 1
+    logger.info("[CAPTURE] Captured piece %s at track-%s", captured.piece_id, position)
+    
+    result["action"] += "_and_captured"
+    result["captured_piece_id"] = captured.piece_id
+    result["captured_player_id"] = captured.player_id
+
+
+def get_own_piece_at_position(session: GameSession, player: Player, state: PieceStatus, position: int) -> Optional[Piece]:
     """Najde vlastní figuru na dané pozici"""
-    for piece in player.pieces:
-        if piece.status.value == state and piece.position == position:
-            return piece
+    if state == PieceStatus.TRACK:
+        if (player.own_track_mask >> position) & 1:
+            return session.track_occupancy.get(position)
+    elif state == PieceStatus.HOME_LANE:
+        if (player.own_lane_mask >> position) & 1:
+            return session.lane_occupancy.get((player.color, position))
     return None
 
 
-def can_move_piece(session: GameSession, player: Player, piece: Piece, dice_roll: int) -> bool:
-    """Zkontroluje, zda může hráč pohnout figurkou"""
-    if piece.status == PieceStatus.FINISHED:
-        return False
-    
-    color = player.color
-    if not color:
-        return False
-    
+def _can_move_core(status: PieceStatus, position: int, dice_roll: int, start_idx: int, entry_idx: int,
+                   own_track_mask: int, own_lane_mask: int) -> bool:
+    """Čistě aritmetické jádro kontroly tahu - pracuje jen s čísly a bitovými maskami obsazenosti"""
     # 1) Start z domku (home → track)
-    if piece.status == PieceStatus.HOME:
-        if dice_roll != 6:
-            return False
-        
-        start_pos = START_INDEX[color]
-        
-        # Zkontroluj, zda na startu není vlastní figurka
-        if get_own_piece_at_position(player, "track", start_pos):
-            return False
-        
-        # Start může být obsazen soupeřem (vyhodí se)
-        return True
+    if status == PieceStatus.HOME:
+        # Start může být obsazen soupeřem (vyhodí se), ne vlastní figurkou
+        return dice_roll == 6 and not (own_track_mask >> start_idx) & 1
     
     # 2) Pohyb po tracku (track → track / track → home_lane)
-    if piece.status == PieceStatus.TRACK:
-        cur = piece.position
-        entry = ENTRY_INDEX[color]
-        steps_to_entry = (entry - cur + TRACK_LEN) % TRACK_LEN
+    if status == PieceStatus.TRACK:
+        steps_to_entry = (entry_idx - position + TRACK_LEN) % TRACK_LEN
         
         if dice_roll > steps_to_entry:
             # Vstupuje do lane
@@ -129,27 +170,16 @@ def can_move_piece(session: GameSession, player: Player, piece: Piece, dice_roll
             if lane_step >= LANE_LEN:
                 return False  # Přestřelení cíle
             
-            # Zkontroluj obsazení lane políčka
-            if get_own_piece_at_position(player, "home_lane", lane_step):
-                return False
-            
             # Lane je jen vlastní, soupeř tam nemůže být
-            return True
-        else:
-            # Normální posun po tracku
-            new_pos = (cur + dice_roll) % TRACK_LEN
-            
-            # Zkontroluj, zda na nové pozici není vlastní figurka
-            if get_own_piece_at_position(player, "track", new_pos):
-                return False
-            
-            # Soupeř se může vyhodit (to je OK)
-            return True
+            return not (own_lane_mask >> lane_step) & 1
+        
+        # Normální posun po tracku - soupeř se může vyhodit (to je OK)
+        new_pos = (position + dice_roll) % TRACK_LEN
+        return not (own_track_mask >> new_pos) & 1
     
     # 3) Pohyb v cílové dráze (home_lane → home_lane / finished)
-    if piece.status == PieceStatus.HOME_LANE:
-        cur_lane_pos = piece.position
-        new_lane_pos = cur_lane_pos + dice_roll
+    if status == PieceStatus.HOME_LANE:
+        new_lane_pos = position + dice_roll
         
         if new_lane_pos > LANE_LEN - 1:
             return False  # Přestřelení - musí se trefit přesně
@@ -158,15 +188,27 @@ def can_move_piece(session: GameSession, player: Player, piece: Piece, dice_roll
             # Dojde do cíle (finished)
             return True
         
-        # Zkontroluj obsazení cílového lane políčka
-        if get_own_piece_at_position(player, "home_lane", new_lane_pos):
-            return False
-        
-        return True
+        return not (own_lane_mask >> new_lane_pos) & 1
     
     return False
 
 
+def can_move_piece(session: GameSession, player: Player, piece: Piece, dice_roll: int) -> bool:
+    """Zkontroluje, zda může hráč pohnout figurkou"""
+    if piece.status == PieceStatus.FINISHED:
+        return False
+    
+    color = player.color
+    if not color:
+        return False
+    
+    return _can_move_core(
+        piece.status, piece.position, dice_roll,
+        player.start_position, player.entry_position,
+        player.own_track_mask, player.own_lane_mask,
+    )
+
+
 def move_piece(session: GameSession, player: Player, piece: Piece, dice_roll: int) -> Dict[str, Any]:
     """Pohne figurkou podle specifikace"""
     if not can_move_piece(session, player, piece, dice_roll):
@@ -176,85 +218,61 @@ def move_piece(session: GameSession, player: Player, piece: Piece, dice_roll: in
     if not color:
         raise ValueError("Hráč nemá barvu")
     
-    # Debug log (pouze pokud je LOG_LEVEL=DEBUG nebo INFO)
-    logger.debug(f"[MOVE] pawn_id={piece.piece_id}, color={color}, state={piece.status.value}, position={piece.position}, dice={dice_roll}")
+    # Debug log (formátuje se pouze pokud je LOG_LEVEL=DEBUG)
+    logger.debug("[MOVE] pawn_id=%s, color=%s, state=%s, position=%s, dice=%s",
+                 piece.piece_id, color, STATUS_NAMES[piece.status], piece.position, dice_roll)
     
     # 1) Start z domku (home → track)
     if piece.status == PieceStatus.HOME:
-        start_pos = START_INDEX[color]
+        start_pos = player.start_position
+        result = {
+            "action": "piece_exited_home",
+            "piece_id": piece.piece_id,
+            "new_position": start_pos
+        }
         
         # Zkontroluj vyhození na startu
-        captured_piece = None
-        for other_player in session.players:
-            if other_player.player_id == player.player_id:
-                continue
-            for other_piece in other_player.pieces:
-                if other_piece.status == PieceStatus.TRACK and other_piece.position == start_pos:
-                    captured_piece = other_piece
-                    break
-            if captured_piece:
-                break
-        
+        captured_piece = _find_opponent_on_track(session, player, start_pos)
         if captured_piece:
-            # Vyhození soupeře
-            captured_piece.status = PieceStatus.HOME
-            captured_piece.position = captured_piece.home_position  # Vrátí se na svůj home slot
-            player.stats_captures += 1
-            logger.info(f"[CAPTURE] Captured piece {captured_piece.piece_id} at start position")
+            _capture(session, captured_piece, player, result)
         
-        piece.status = PieceStatus.TRACK
-        piece.position = start_pos
+        _set_track(session, player, piece, start_pos)
         player.stats_deployments += 1
         
-        logger.info(f"[MOVE] Exited home, new position: track-{start_pos}")
-        
-        if captured_piece:
-            return {
-                "action": "piece_exited_home_and_captured",
-                "piece_id": piece.piece_id,
-                "new_position": piece.position,
-                "captured_piece_id": captured_piece.piece_id,
-                "captured_player_id": captured_piece.player_id
-            }
-        
-        return {
-            "action": "piece_exited_home",
-            "piece_id": piece.piece_id,
-            "new_position": piece.position
-        }
+        logger.info("[MOVE] Exited home, new position: track-%s", start_pos)
+        return result
     
     # 2) Pohyb po tracku (track → track / track → home_lane)
     if piece.status == PieceStatus.TRACK:
         cur = piece.position
-        entry = ENTRY_INDEX[color]
+        entry = player.entry_position
         steps_to_entry = (entry - cur + TRACK_LEN) % TRACK_LEN
         
-        logger.debug(f"[MOVE] cur={cur}, entry={entry}, stepsToEntry={steps_to_entry}")
+        logger.debug("[MOVE] cur=%s, entry=%s, stepsToEntry=%s", cur, entry, steps_to_entry)
         
         if dice_roll > steps_to_entry:
             # Vstupuje do lane
             lane_step = dice_roll - steps_to_entry - 1
             
-            logger.info(f"[MOVE] Entering lane, laneStep={lane_step}")
+            logger.info("[MOVE] Entering lane, laneStep=%s", lane_step)
             
             if lane_step >= LANE_LEN:
                 raise ValueError("Přestřelení cíle")
             
             # Zkontroluj obsazení lane políčka (vlastní figurka)
-            if get_own_piece_at_position(player, "home_lane", lane_step):
+            if get_own_piece_at_position(session, player, PieceStatus.HOME_LANE, lane_step):
                 raise ValueError("Lane políčko je obsazené vlastní figurkou")
             
             # Přesun do lane
             old_position = piece.position
-            piece.status = PieceStatus.HOME_LANE
-            piece.position = lane_step
             
             # Pokud je na posledním lane políčku, je finished
             if lane_step == LANE_LEN - 1:
-                piece.status = PieceStatus.FINISHED
-                piece.position = None
+                _set_finished(session, player, piece)
+            else:
+                _set_lane(session, player, piece, lane_step)
             
-            logger.info(f"[MOVE] Entered lane, new position: lane-{color}-{lane_step}")
+            logger.info("[MOVE] Entered lane, new position: lane-%s-%s", color, lane_step)
             
             return {
                 "action": "piece_entered_lane",
@@ -263,55 +281,30 @@ def move_piece(session: GameSession, player: Player, piece: Piece, dice_roll: in
                 "new_position": piece.position,
                 "lane_position": lane_step
             }
-        else:
-            # Normální posun po tracku
-            new_pos = (cur + dice_roll) % TRACK_LEN
-            
-            # Zkontroluj obsazení (vlastní figurka)
-            if get_own_piece_at_position(player, "track", new_pos):
-                raise ValueError("Track políčko je obsazené vlastní figurkou")
-            
-            old_position = piece.position
-            piece.position = new_pos
-            
-            # Zkontroluj vyhození soupeře
-            captured_piece = None
-            for other_player in session.players:
-                if other_player.player_id == player.player_id:
-                    continue
-                for other_piece in other_player.pieces:
-                    if other_piece.status == PieceStatus.TRACK and other_piece.position == new_pos:
-                        captured_piece = other_piece
-                        break
-                if captured_piece:
-                    break
-            
-            if captured_piece:
-                # Vyhození soupeře
-                captured_piece.status = PieceStatus.HOME
-                captured_piece.position = captured_piece.home_position  # Vrátí se na svůj home slot
-                player.stats_captures += 1
-                logger.info(f"[CAPTURE] Captured piece {captured_piece.piece_id} at track-{new_pos}")
-            
-            player.stats_moves += 1
-            logger.info(f"[MOVE] Moved on track, new position: track-{new_pos}")
-            
-            if captured_piece:
-                return {
-                    "action": "piece_moved_and_captured",
-                    "piece_id": piece.piece_id,
-                    "old_position": old_position,
-                    "new_position": piece.position,
-                    "captured_piece_id": captured_piece.piece_id,
-                    "captured_player_id": captured_piece.player_id
-                }
-            
-            return {
-                "action": "piece_moved",
-                "piece_id": piece.piece_id,
-                "old_position": old_position,
-                "new_position": piece.position
-            }
+        
+        # Normální posun po tracku
+        new_pos = (cur + dice_roll) % TRACK_LEN
+        
+        # Zkontroluj obsazení (vlastní figurka)
+        if get_own_piece_at_position(session, player, PieceStatus.TRACK, new_pos):
+            raise ValueError("Track políčko je obsazené vlastní figurkou")
+        
+        result = {
+            "action": "piece_moved",
+            "piece_id": piece.piece_id,
+            "old_position": piece.position,
+            "new_position": new_pos
+        }
+        
+        # Zkontroluj vyhození soupeře
+        captured_piece = _find_opponent_on_track(session, player, new_pos)
+        if captured_piece:
+            _capture(session, captured_piece, player, result)
+        
+        _set_track(session, player, piece, new_pos)
+        player.stats_moves += 1
+        logger.info("[MOVE] Moved on track, new position: track-%s", new_pos)
+        return result
     
     # 3) Pohyb v cílové dráze (home_lane → home_lane / finished)
     if piece.status == PieceStatus.HOME_LANE:
@@ -323,19 +316,18 @@ def move_piece(session: GameSession, player: Player, piece: Piece, dice_roll: in
         
         # Zkontroluj obsazení (vlastní figurka)
         if new_lane_pos < LANE_LEN - 1:
-            if get_own_piece_at_position(player, "home_lane", new_lane_pos):
+            if get_own_piece_at_position(session, player, PieceStatus.HOME_LANE, new_lane_pos):
                 raise ValueError("Lane políčko je obsazené vlastní figurkou")
         
         old_position = piece.position
         
         if new_lane_pos == LANE_LEN - 1:
             # Dojde do cíle (finished)
-            piece.status = PieceStatus.FINISHED
-            piece.position = None
-            logger.info(f"[MOVE] Finished, position: lane-{color}-3")
+            _set_finished(session, player, piece)
+            logger.info("[MOVE] Finished, position: lane-%s-3", color)
         else:
-            piece.position = new_lane_pos
-            logger.info(f"[MOVE] Moved in lane, new position: lane-{color}-{new_lane_pos}")
+            _set_lane(session, player, piece, new_lane_pos)
+            logger.info("[MOVE] Moved in lane, new position: lane-%s-%s", color, new_lane_pos)
         
         player.stats_moves += 1
         
@@ -352,71 +344,97 @@ def move_piece(session: GameSession, player: Player, piece: Piece, dice_roll: in
 
 def has_pieces_on_board(session: GameSession, player: Player) -> bool:
     """Zkontroluje, zda má hráč nějaké figurky na hrací ploše (track nebo home_lane)"""
-    return any(
-        piece.status == PieceStatus.TRACK or piece.status == PieceStatus.HOME_LANE
-        for piece in player.pieces
-    )
+    return player.on_board_count > 0
 
 
-def get_can_move_pawn_ids(session: GameSession, player: Player, dice_roll: int) -> List[str]:
-    """Vrátí seznam ID figurek, kterými může hráč táhnout"""
+class TurnOptions(NamedTuple):
+    """Možnosti hráče po hodu kostkou"""
+    has_on_board: bool
+    movable_ids: List[str]  # sdílený seznam z cache - neměnit
+    initial_rolls: int  # zbývající úvodní pokusy o šestku
+
+
+def _legal_move_ids(session: GameSession, player: Player, dice_roll: int) -> List[str]:
+    """ID figurek, kterými může hráč táhnout - cachovaný seznam (bez kopie)"""
+    if session.legal_moves_version != session.state_version:
+        session.legal_moves_cache.clear()
+        session.legal_moves_version = session.state_version
+    
+    key = (player.player_id, dice_roll)
+    cached = session.legal_moves_cache.get(key)
+    if cached is not None:
+        return cached
+    
     can_move = []
-    for piece in player.pieces:
-        if can_move_piece(session, player, piece, dice_roll):
-            can_move.append(piece.piece_id)
+    if player.color:
+        # Invarianty hráče načteme jednou pro všechny figurky
+        start_idx = player.start_position
+        entry_idx = player.entry_position
+        track_mask = player.own_track_mask
+        lane_mask = player.own_lane_mask
+        for piece in player.pieces:
+            if _can_move_core(piece.status, piece.position, dice_roll,
+                              start_idx, entry_idx, track_mask, lane_mask):
+                can_move.append(piece.piece_id)
+    session.legal_moves_cache[key] = can_move
     return can_move
 
 
+def get_can_move_pawn_ids(session: GameSession, player: Player, dice_roll: int) -> List[str]:
+    """Vrátí seznam ID figurek, kterými může hráč táhnout"""
+    return list(_legal_move_ids(session, player, dice_roll))
+
+
+def compute_turn_options(session: GameSession, player: Player, dice_roll: int) -> TurnOptions:
+    """Vše, co handler hodu potřebuje, v jednom volání"""
+    return TurnOptions(
+        has_on_board=player.on_board_count > 0,
+        movable_ids=_legal_move_ids(session, player, dice_roll),
+        initial_rolls=session.initial_rolls_remaining.get(player.player_id, 0),
+    )
+
+
+def advance_to_next_player(session: GameSession) -> None:
+    """Předá tah dalšímu hráči"""
+    session.bump()
+    # Vynuluj kostku před předáním tahu dalšímu hráči
+    session.last_dice_roll = 0
+    next_player = session.get_next_player()
+    if next_player:
+        session.set_current_player(next_player.player_id)
+        # Pokud nový hráč nemá figurky na ploše, reset počítadla
+        if not has_pieces_on_board(session, next_player):
+            session.initial_rolls_remaining[next_player.player_id] = 3
+    session.can_roll_dice = True
+
+
 def end_turn(session: GameSession, dice_roll: int, after_move: bool = False) -> None:
     """Ukončí tah hráče"""
     current_player = session.get_current_player()
     if not current_player:
         return
-    
-    # Aktualizuj statistiky - tah
-    if not after_move or dice_roll != 6:
-        current_player.stats_turns += 1
+    session.bump()
     
     # Pokud hráč hodil 6 a pohnul figurkou, může házet znovu
     if dice_roll == 6 and after_move:
         session.can_roll_dice = True
         return
     
-    # Pokud hráč hodil 6, ale neměl žádný legální tah, extra hod propadne (MVP)
-    if dice_roll == 6 and not after_move:
-        # Propadne - přejde na dalšího hráče
-        session.last_dice_roll = 0
-        next_player = session.get_next_player()
-        if next_player:
-            session.current_player_id = next_player.player_id
-            # Pokud nový hráč nemá figurky na ploše, reset počítadla
-            if not has_pieces_on_board(session, next_player):
-                session.initial_rolls_remaining[next_player.player_id] = 3
-        session.can_roll_dice = True
-        return
+    # Aktualizuj statistiky - tah
+    current_player.stats_turns += 1
     
-    # Pokud hráč nehodil 6, přejde na dalšího hráče
-    if dice_roll != 6 or not after_move:
-        # Vynuluj kostku před předáním tahu dalšímu hráči
-        session.last_dice_roll = 0
-        # Reset počítadla pro nového hráče (pokud nemá figurky na ploše)
-        next_player = session.get_next_player()
-        if next_player:
-            session.current_player_id = next_player.player_id
-            # Pokud nový hráč nemá figurky na ploše, reset počítadla
-            if not has_pieces_on_board(session, next_player):
-                session.initial_rolls_remaining[next_player.player_id] = 3
-        session.can_roll_dice = True
+    # Jinak přejde na dalšího hráče (i po šestce bez legálního tahu - extra hod propadne)
+    advance_to_next_player(session)
 
 
 def check_game_end(session: GameSession) -> Optional[str]:
     """Zkontroluje, zda hra skončila (někdo vyhrál)"""
     for player in session.players:
-        finished_pieces = [p for p in player.pieces if p.status == PieceStatus.FINISHED]
-        if len(finished_pieces) == 4:
+        if player.finished_count == 4:
             # Hráč má všechny figurky v cíli - vyhrál!
             session.status = GameStatus.FINISHED
             session.winner_id = player.player_id
+            session.bump()
             return player.player_id
     
     return None
@@ -1,6 +1,6 @@
 from dataclasses import dataclass, field
-from enum import Enum
-from typing import List, Optional, Dict, Any
+from enum import Enum, IntEnum
+from typing import List, Optional, Dict, Any, Set, Tuple
 import time
 import uuid
 
@@ -11,14 +11,18 @@ class GameStatus(Enum):
     FINISHED = "finished"
 
 
-class PieceStatus(Enum):
-    HOME = "home"  # V domečku
-    TRACK = "track"  # Na hlavní dráze
-    HOME_LANE = "home_lane"  # V cílové dráze (lane)
-    FINISHED = "finished"  # V cíli
+class PieceStatus(IntEnum):
+    HOME = 0  # V domečku
+    TRACK = 1  # Na hlavní dráze
+    HOME_LANE = 2  # V cílové dráze (lane)
+    FINISHED = 3  # V cíli
 
 
-@dataclass
+# Názvy stavů pro serializaci (index = hodnota PieceStatus)
+STATUS_NAMES = ("home", "track", "home_lane", "finished")
+
+
+@dataclass(slots=True)
 class Piece:
     """Figurka hráče"""
     piece_id: str
@@ -26,18 +30,27 @@ class Piece:
     status: PieceStatus = PieceStatus.HOME
     position: Optional[int] = 0  # home:0..3, track:0..51, home_lane:0..3, finished:None
     home_position: int = 0  # Pořadí v domečku (0-3) - stabilní home slot
+    # Cache serializace: ((status, position), dict)
+    _dict_cache: Optional[Tuple[Tuple[int, Optional[int]], Dict[str, Any]]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
     
     def to_dict(self) -> Dict[str, Any]:
-        return {
+        key = (self.status, self.position)
+        if self._dict_cache and self._dict_cache[0] == key:
+            return self._dict_cache[1]
+        data = {
             "piece_id": self.piece_id,
             "player_id": self.player_id,
-            "status": self.status.value,
+            "status": STATUS_NAMES[self.status],
             "position": self.position,
             "home_position": self.home_position
         }
+        self._dict_cache = (key, data)
+        return data
 
 
-@dataclass
+@dataclass(slots=True)
 class Player:
     """Hráč"""
     player_id: str
@@ -47,32 +60,71 @@ class Player:
     pieces: List[Piece] = field(default_factory=list)
     ready: bool = False
     start_position: int = 0  # Startovní pozice na hrací ploše
+    entry_position: int = 0  # Vstup do cílové dráhy (políčko těsně před startem)
+    own_track_mask: int = 0  # Bit i = vlastní figurka na track pozici i (0-51)
+    own_lane_mask: int = 0  # Bit i = vlastní figurka na lane pozici i (0-3)
+    finished_count: int = 0  # Počet figurek v cíli
+    on_board_count: int = 0  # Počet figurek na hrací ploše (track nebo home_lane)
     # Statistiky
     stats_turns: int = 0  # Počet tahů
     stats_deployments: int = 0  # Počet nasazení figurek
     stats_moves: int = 0  # Počet pohybů figurek
     stats_captures: int = 0  # Počet zajatých figurek
     stats_sixes: int = 0  # Počet hozených šestek
+    # Cache serializace: hide_pieces -> (state_version, dict)
+    _dict_cache: Dict[bool, Tuple[int, Dict[str, Any]]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _pieces_by_id: Dict[str, Piece] = field(default_factory=dict, init=False, repr=False, compare=False)
     
     def __post_init__(self):
         if not self.pieces:
             # Vytvoří 4 figurky pro hráče
             for i in range(4):
                 self.pieces.append(Piece(
-                    piece_id=str(uuid.uuid4()),
+                    piece_id=uuid.uuid4().hex,
                     player_id=self.player_id,
                     home_position=i
                 ))
+        self._pieces_by_id = {p.piece_id: p for p in self.pieces}
+    
+    def get_piece(self, piece_id: str) -> Optional[Piece]:
+        """Vrátí figurku podle ID"""
+        return self._pieces_by_id.get(piece_id)
+    
+    def reset_stats(self) -> None:
+        """Vynuluje statistiky hráče"""
+        self.stats_turns = 0
+        self.stats_deployments = 0
+        self.stats_moves = 0
+        self.stats_captures = 0
+        self.stats_sixes = 0
+        self._dict_cache.clear()
     
-    def to_dict(self, hide_pieces: bool = False) -> Dict[str, Any]:
-        return {
+    def reset_pieces(self) -> None:
+        """Vrátí všechny figurky do domečku"""
+        for piece in self.pieces:
+            piece.status = PieceStatus.HOME
+            piece.position = piece.home_position  # home slot (0-3)
+        self.own_track_mask = 0
+        self.own_lane_mask = 0
+        self.finished_count = 0
+        self.on_board_count = 0
+    
+    def to_dict(self, hide_pieces: bool = False, version: Optional[int] = None) -> Dict[str, Any]:
+        """Serializuje hráče; s verzí stavu session vrací cachovaný dict, dokud se stav nezmění"""
+        if version is not None:
+            cached = self._dict_cache.get(hide_pieces)
+            if cached and cached[0] == version:
+                return cached[1]
+        data = {
             "player_id": self.player_id,
             "name": self.name,
             "color": self.color,
             "ready": self.ready,
             "start_position": self.start_position,
             "pieces": [] if hide_pieces else [p.to_dict() for p in self.pieces],
-            "pieces_count": len([p for p in self.pieces if p.status == PieceStatus.FINISHED]),
+            "pieces_count": self.finished_count,
             "stats": {
                 "turns": self.stats_turns,
                 "deployments": self.stats_deployments,
@@ -81,6 +133,9 @@ class Player:
                 "sixes": self.stats_sixes
             }
         }
+        if version is not None:
+            self._dict_cache[hide_pieces] = (version, data)
+        return data
 
 
 @dataclass
@@ -98,16 +153,119 @@ class GameSession:
     solo_player_id: Optional[str] = None
     created_at: float = field(default_factory=time.time)
     last_activity: float = field(default_factory=time.time)
+    # Index obsazenosti: track pozice -> figurka, (barva, lane pozice) -> figurka
+    track_occupancy: Dict[int, Piece] = field(default_factory=dict)
+    lane_occupancy: Dict[Tuple[str, int], Piece] = field(default_factory=dict)
+    # Verze stavu hráčů a figurek - zvyšuje se při každé změně (invalidace cache)
+    state_version: int = 0
+    legal_moves_version: int = -1
+    legal_moves_cache: Dict[Tuple[str, int], List[str]] = field(default_factory=dict)
+    # Legální tahy po posledním hodu: (state_version, {piece_id}) - platí do další změny stavu
+    current_turn_moves: Optional[Tuple[int, Set[str]]] = None
+    # Pořadí tahů: player_id -> index v players, index hráče na tahu (-1 = žádný)
+    player_index: Dict[str, int] = field(default_factory=dict)
+    current_turn_idx: int = -1
+    _player_by_id: Dict[str, Player] = field(default_factory=dict, init=False, repr=False)
+    # Lobby: počet připravených hráčů a obsazené barvy (udržují set_player_ready/set_player_color)
+    _ready_count: int = field(default=0, init=False, repr=False)
+    _colors_in_use: Set[str] = field(default_factory=set, init=False, repr=False)
+    _names_lower: Set[str] = field(default_factory=set, init=False, repr=False)
+    # Cache serializace hráčů: (state_version, seznam dictů)
+    _players_cache: Optional[Tuple[int, List[Dict[str, Any]]]] = field(default=None, init=False, repr=False)
+    _dict_cache: Optional[Tuple[int, Dict[str, Any]]] = field(default=None, init=False, repr=False)
+    # Cache zakódovaného game_state pro broadcast: (state_version, payload)
+    state_payload_cache: Optional[Tuple[int, str]] = field(default=None, init=False, repr=False)
+    # Totéž pro lobby_state + verze, kterou už dostali všichni připojení hráči
+    lobby_payload_cache: Optional[Tuple[int, str]] = field(default=None, init=False, repr=False)
+    lobby_sent_version: int = field(default=-1, init=False, repr=False)
+    
+    COLORS = ("red", "blue", "green", "yellow")
+    COLORS_SET = frozenset(COLORS)  # pro testy příslušnosti, pořadí drží COLORS
+    START_POSITIONS = (0, 13, 26, 39)
+    
+    def __post_init__(self):
+        self.index_players()
     
-    COLORS = ["red", "blue", "green", "yellow"]
-    START_POSITIONS = [0, 13, 26, 39]
+    def bump(self) -> None:
+        """Označí změnu stavu (invaliduje cache odvozené ze stavu)"""
+        self.state_version += 1
     
     def get_player(self, player_id: str) -> Optional[Player]:
         """Získá hráče podle ID"""
-        for player in self.players:
-            if player.player_id == player_id:
-                return player
-        return None
+        return self._player_by_id.get(player_id)
+    
+    def add_player(self, player: Player) -> None:
+        """Přidá hráče do místnosti"""
+        self.players.append(player)
+        self.index_players()
+    
+    def add_players(self, players: List[Player]) -> None:
+        """Přidá více hráčů najednou (jedno přepočítání indexů)"""
+        if players:
+            self.players.extend(players)
+            self.index_players()
+    
+    def remove_player(self, player_id: str) -> None:
+        """Odebere hráče i jeho figurky z indexu obsazenosti"""
+        player = self.get_player(player_id)
+        if not player:
+            return
+        for piece in player.pieces:
+            if piece.status == PieceStatus.TRACK:
+                self.track_occupancy.pop(piece.position, None)
+            elif piece.status == PieceStatus.HOME_LANE:
+                self.lane_occupancy.pop((player.color, piece.position), None)
+        player.own_track_mask = 0
+        player.own_lane_mask = 0
+        player.on_board_count = 0
+        del self.players[self.player_index[player_id]]
+        self.index_players()
+    
+    def index_players(self) -> None:
+        """Přepočítá indexy hráčů (podle ID a pořadí tahů) po změně seznamu hráčů a zvýší verzi stavu"""
+        self._player_by_id = {p.player_id: p for p in self.players}
+        self.player_index = {p.player_id: i for i, p in enumerate(self.players)}
+        self._ready_count = sum(1 for p in self.players if p.ready)
+        self._colors_in_use = {p.color for p in self.players if p.color}
+        self._names_lower = {p.name.lower() for p in self.players}
+        self.current_turn_idx = self.player_index.get(self.current_player_id, -1)
+        self.bump()
+    
+    def set_player_ready(self, player: Player, ready: bool) -> None:
+        """Nastaví připravenost hráče"""
+        if player.ready == ready:
+            return
+        self._ready_count += 1 if ready else -1
+        player.ready = ready
+        self.bump()
+    
+    def set_player_color(self, player: Player, color: Optional[str]) -> None:
+        """Nastaví barvu hráče"""
+        if player.color == color:
+            return
+        if player.color:
+            self._colors_in_use.discard(player.color)
+        player.color = color
+        if color:
+            self._colors_in_use.add(color)
+        self.bump()
+    
+    def all_ready(self) -> bool:
+        """Jsou všichni hráči připraveni?"""
+        return self._ready_count == len(self.players)
+    
+    def has_name(self, name: str) -> bool:
+        """Je jméno v místnosti obsazené? (bez ohledu na velikost písmen)"""
+        return name.lower() in self._names_lower
+    
+    def used_colors(self) -> Set[str]:
+        """Obsazené barvy (jen pro čtení)"""
+        return self._colors_in_use
+    
+    def set_current_player(self, player_id: Optional[str]) -> None:
+        """Nastaví hráče na tahu"""
+        self.current_player_id = player_id
+        self.current_turn_idx = self.player_index.get(player_id, -1)
     
     def get_current_player(self) -> Optional[Player]:
         """Získá aktuálního hráče"""
@@ -123,20 +281,24 @@ class GameSession:
         if not self.current_player_id:
             return self.players[0]
         
-        current_index = next(
-            (i for i, p in enumerate(self.players) if p.player_id == self.current_player_id),
-            -1
-        )
-        
-        if current_index == -1:
-            return self.players[0]
-        
-        next_index = (current_index + 1) % len(self.players)
-        return self.players[next_index]
+        # Neznámý hráč na tahu (current_turn_idx == -1) -> první hráč
+        return self.players[(self.current_turn_idx + 1) % len(self.players)]
+    
+    def players_to_dict(self) -> List[Dict[str, Any]]:
+        """Serializuje hráče - jeden sdílený seznam pro všechny příjemce, dokud se stav nezmění"""
+        cached = self._players_cache
+        if cached and cached[0] == self.state_version:
+            return cached[1]
+        data = [p.to_dict(version=self.state_version) for p in self.players]
+        self._players_cache = (self.state_version, data)
+        return data
     
     def to_dict(self) -> Dict[str, Any]:
-        """Serializuje herní stav"""
-        return {
+        """Serializuje herní stav; mezi změnami vrací mělkou kopii cachovaného dictu"""
+        cached = self._dict_cache
+        if cached and cached[0] == self.state_version:
+            return dict(cached[1])
+        data = {
             "room_code": self.room_code,
             "status": self.status.value,
             "current_player_id": self.current_player_id,
@@ -145,6 +307,8 @@ class GameSession:
             "winner_id": self.winner_id,
             "solo_mode": self.solo_mode,
             "solo_player_id": self.solo_player_id,
-            "players": [p.to_dict() for p in self.players]
+            "players": self.players_to_dict()
         }
+        self._dict_cache = (self.state_version, data)
+        return dict(data)
 
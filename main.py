@@ -6,18 +6,19 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-import json
+from websockets.exceptions import ConnectionClosed
+import orjson
 import re
 import uuid
 import logging
 import time
 import os
-from collections import defaultdict
-from typing import Dict, Optional
-from app.models import GameSession, Player, GameStatus, PieceStatus
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+from app.models import GameSession, Player, GameStatus
 from app.game_logic import (
-    initialize_game, roll_dice, move_piece, end_turn,
-    check_game_end, can_move_piece, has_pieces_on_board, get_can_move_pawn_ids,
+    initialize_game, roll_dice, move_piece, end_turn, advance_to_next_player,
+    check_game_end, can_move_piece, compute_turn_options,
 )
 
 log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -35,6 +36,8 @@ RATE_LIMIT_MESSAGES = 30
 RATE_LIMIT_WINDOW = 10
 PLAYER_NAME_MAX_LENGTH = 20
 PLAYER_NAME_PATTERN = re.compile(r'^[\w\s\-áčďéěíňóřšťúůýžÁČĎÉĚÍŇÓŘŠŤÚŮÝŽ]{1,20}$')
+# Běžné znaky jmen - rychlá kontrola bez regexu (regex řeší zbytek Unicode \w/\s)
+PLAYER_NAME_CHARS = frozenset(string.ascii_letters + string.digits + "_ -áčďéěíňóřšťúůýžÁČĎÉĚÍŇÓŘŠŤÚŮÝŽ")
 WS_PING_INTERVAL = 30
 PLAYER_DISCONNECT_TIMEOUT = 120
 DISCONNECT_GRACE_PERIOD = 15
@@ -43,21 +46,64 @@ MAX_ROOMS = 50
 EMPTY_ROOM_TIMEOUT = 300  # smazat prázdnou místnost po 5 min
 GAME_INACTIVITY_TIMEOUT = 1800  # ukončit hru po 30 min neaktivity
 ROOM_CODE_LENGTH = 4
+ROOM_CODE_ALPHABET = string.ascii_uppercase
+LOBBY_FLUSH_DELAY = 0.05  # sloučení rychlých změn v lobby do jednoho broadcastu
+BOT_POOL_SIZE = 64
+OUTBOUND_QUEUE_SIZE = 64  # max. čekajících zpráv na socket, pak se klient odpojí
+PING_FRAME = orjson.dumps({"type": "ping"}).decode()
 
 
 # ╔══════════════════════════════════════════════╗
 # ║  Globální stav                               ║
 # ╚══════════════════════════════════════════════╝
 
+@dataclass(slots=True)
+class ClientSocket:
+    """WebSocket klienta - veškeré odesílání jde přes frontu, jediným zapisovatelem je writer task"""
+    ws: WebSocket
+    out_queue: asyncio.Queue
+    writer: Optional[asyncio.Task] = None
+    closed: bool = False
+
+    def push(self, payload: str) -> bool:
+        """Zařadí zprávu k odeslání; při plné frontě klienta zavře a vrátí False"""
+        if self.closed:
+            return False
+        try:
+            self.out_queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            # Klient nestíhá - místo blokování místnosti ho odpojíme
+            self.closed = True
+            task = asyncio.create_task(close_slow_socket(self.ws))
+            # Reference drží task naživu, dokud socket nezavře (jinak ho může sebrat GC)
+            close_tasks.add(task)
+            task.add_done_callback(close_tasks.discard)
+            return False
+
+    async def send_json(self, message: dict):
+        self.push(encode_message(message))
+
+
+@dataclass(slots=True)
+class PlayerConn:
+    """Spojení hráče - token, místnost, aktivita a aktuální socket"""
+    token: str
+    room_code: str
+    last_activity: float
+    client: Optional[ClientSocket] = None
+
+
 rooms: Dict[str, GameSession] = {}          # room_code -> session
-connected_clients: Dict[str, WebSocket] = {}  # player_id -> ws
-player_tokens: Dict[str, str] = {}          # player_id -> token
-player_room: Dict[str, str] = {}            # player_id -> room_code
-player_last_activity: Dict[str, float] = {}
+player_conns: Dict[str, PlayerConn] = {}    # player_id -> spojení
+token_to_player: Dict[str, str] = {}        # token -> player_id
 
-ip_connections: Dict[str, int] = defaultdict(int)
-rate_limit_buckets: Dict[str, list] = defaultdict(list)
+ip_connections: Dict[str, int] = {}
+rate_limit_state: Dict[str, Tuple[float, float]] = {}  # client -> (tokens, last_ts)
 disconnect_tasks: Dict[str, asyncio.Task] = {}
+lobby_flush_tasks: Dict[str, asyncio.Task] = {}  # room_code -> odložený lobby_state
+close_tasks: Set[asyncio.Task] = set()      # běžící zavírání pomalých socketů
+bot_pool: List[Player] = []                 # uvolnění boti k znovupoužití
 
 
 # ╔══════════════════════════════════════════════╗
@@ -65,12 +111,23 @@ disconnect_tasks: Dict[str, asyncio.Task] = {}
 # ╚══════════════════════════════════════════════╝
 
 def generate_room_code() -> str:
+    # Jeden náhodný blok místo volání secrets.choice pro každé písmeno
+    # (modulo bias 256 % 26 je pro kód místnosti zanedbatelný)
     while True:
-        code = ''.join(secrets.choice(string.ascii_uppercase) for _ in range(ROOM_CODE_LENGTH))
+        code = ''.join(ROOM_CODE_ALPHABET[b % 26] for b in secrets.token_bytes(ROOM_CODE_LENGTH))
         if code not in rooms:
             return code
 
 
+def new_id() -> str:
+    # hex bez pomlček - kratší a rychlejší než str(uuid4())
+    return uuid.uuid4().hex
+
+
+def new_token() -> str:
+    return secrets.token_hex(16)
+
+
 def get_client_ip(websocket: WebSocket) -> str:
     forwarded = websocket.headers.get("x-forwarded-for")
     if forwarded:
@@ -80,13 +137,14 @@ def get_client_ip(websocket: WebSocket) -> str:
     return "unknown"
 
 
-def check_rate_limit(client_key: str) -> bool:
-    now = time.time()
-    bucket = rate_limit_buckets[client_key]
-    bucket[:] = [t for t in bucket if now - t < RATE_LIMIT_WINDOW]
-    if len(bucket) >= RATE_LIMIT_MESSAGES:
+def check_rate_limit(client_key: str, now: float) -> bool:
+    """Token bucket: kapacita RATE_LIMIT_MESSAGES, plné doplnění za RATE_LIMIT_WINDOW sekund."""
+    tokens, last_ts = rate_limit_state.get(client_key, (RATE_LIMIT_MESSAGES, now))
+    tokens = min(RATE_LIMIT_MESSAGES, tokens + (now - last_ts) * RATE_LIMIT_MESSAGES / RATE_LIMIT_WINDOW)
+    if tokens < 1:
+        rate_limit_state[client_key] = (tokens, now)
         return True
-    bucket.append(now)
+    rate_limit_state[client_key] = (tokens - 1, now)
     return False
 
 
@@ -95,21 +153,54 @@ def validate_player_name(name: str) -> Optional[str]:
         return "Jméno je povinné"
     if len(name) > PLAYER_NAME_MAX_LENGTH:
         return f"Jméno může mít maximálně {PLAYER_NAME_MAX_LENGTH} znaků"
-    if not PLAYER_NAME_PATTERN.match(name):
+    if not PLAYER_NAME_CHARS.issuperset(name) and not PLAYER_NAME_PATTERN.fullmatch(name):
         return "Jméno obsahuje nepovolené znaky"
     return None
 
 
+def register_player(pid: str, token: str, room_code: str, client: ClientSocket, now: float) -> PlayerConn:
+    conn = PlayerConn(token=token, room_code=room_code, last_activity=now, client=client)
+    player_conns[pid] = conn
+    token_to_player[token] = pid
+    return conn
+
+
+def forget_player(pid: str):
+    conn = player_conns.pop(pid, None)
+    if conn:
+        token_to_player.pop(conn.token, None)
+
+
+def detach_socket(pid: str, client: ClientSocket):
+    """Odpojí socket od hráče, pokud se mezitím nepřipojil jiným"""
+    conn = player_conns.get(pid)
+    if conn and conn.client is client:
+        conn.client = None
+
+
+def release_socket(client: ClientSocket):
+    """Odpojí uzavřený socket od všech hráčů, kteří ho ještě mají zaregistrovaný"""
+    client.closed = True
+    for conn in player_conns.values():
+        if conn.client is client:
+            conn.client = None
+
+
+def is_connected(pid: str) -> bool:
+    conn = player_conns.get(pid)
+    return conn is not None and conn.client is not None
+
+
 def get_player_room(pid: str) -> Optional[GameSession]:
-    code = player_room.get(pid)
-    if code:
-        return rooms.get(code)
+    conn = player_conns.get(pid)
+    if conn:
+        return rooms.get(conn.room_code)
     return None
 
 
 def reset_room(room: GameSession):
     room.status = GameStatus.WAITING
-    room.current_player_id = None
+    room.set_current_player(None)
     room.last_dice_roll = 0
     room.can_roll_dice = True
     room.initial_rolls_remaining = {}
@@ -117,90 +208,221 @@ def reset_room(room: GameSession):
     room.solo_mode = False
     room.solo_player_id = None
     room.last_activity = time.time()
+    for p in room.players:
+        room.set_player_ready(p, False)
+        p.reset_stats()
+        p.reset_pieces()
+    room.track_occupancy.clear()
+    room.lane_occupancy.clear()
+    room.bump()
+
+
+def acquire_bot(color: str) -> Player:
+    """Vrátí virtuálního hráče pro solo režim - z poolu, nebo nového"""
+    name = f"Bot {color.capitalize()}"
+    if bot_pool:
+        bot = bot_pool.pop()
+        bot.name = name
+        bot.color = color
+        bot.reset_stats()
+        bot.reset_pieces()
+    else:
+        bot = Player(player_id=new_id(), name=name, token=new_token(), color=color)
+    bot.ready = True
+    return bot
+
+
+def release_bot(bot: Player):
+    if len(bot_pool) < BOT_POOL_SIZE:
+        bot_pool.append(bot)
+
+
+def cancel_lobby_flush(room_code: str):
+    pending = lobby_flush_tasks.pop(room_code, None)
+    if pending:
+        pending.cancel()
 
 
 def delete_room(room_code: str):
     room = rooms.pop(room_code, None)
+    cancel_lobby_flush(room_code)
     if room:
         for p in room.players:
-            player_room.pop(p.player_id, None)
-            player_tokens.pop(p.player_id, None)
-            player_last_activity.pop(p.player_id, None)
-        logger.info(f"[ROOM] Místnost {room_code} smazána")
+            if room.solo_mode and p.player_id not in player_conns:
+                release_bot(p)
+            forget_player(p.player_id)
+        logger.info("[ROOM] Místnost %s smazána", room_code)
 
 
 def remove_player_from_room(pid: str, room: GameSession):
-    room.players = [p for p in room.players if p.player_id != pid]
-    player_room.pop(pid, None)
-    player_tokens.pop(pid, None)
-    player_last_activity.pop(pid, None)
-    connected_clients.pop(pid, None)
+    room.remove_player(pid)
+    forget_player(pid)
     room.last_activity = time.time()
+    if not has_connected_players(room):
+        cancel_lobby_flush(room.room_code)
 
 
 # ╔══════════════════════════════════════════════╗
 # ║  Broadcast / send                            ║
 # ╚══════════════════════════════════════════════╝
 
+def encode_message(message: dict) -> str:
+    # orjson je výrazně rychlejší než json.dumps; kompaktní UTF-8 výstup odesíláme jako text
+    return orjson.dumps(message).decode()
+
+
+def has_connected_players(room: GameSession) -> bool:
+    return any(is_connected(p.player_id) for p in room.players)
+
+
 async def broadcast_to_room(room: GameSession, message: dict):
-    disconnected = []
+    if not has_connected_players(room):
+        return
+    await broadcast_payload(room, encode_message(message))
+
+
+async def socket_writer(client: ClientSocket):
+    """Odesílá zprávy z fronty socketu - pomalý klient nebrzdí ostatní."""
+    while True:
+        payload = await client.out_queue.get()
+        try:
+            await client.ws.send_text(payload)
+        except (WebSocketDisconnect, ConnectionClosed):
+            # Klient je pryč - hned ho odregistrujeme, ať mu další broadcasty nic nestaví
+            release_socket(client)
+            return
+        except Exception as e:
+            logger.error("[WS] Chyba při odesílání: %s", e)
+            release_socket(client)
+            return
+
+
+async def close_slow_socket(websocket: WebSocket):
+    try:
+        await websocket.close(code=1008, reason="Klient nestíhá přijímat zprávy")
+    except Exception:
+        pass
+
+
+def enqueue_payload(pid: str, conn: PlayerConn, payload: str):
+    client = conn.client
+    if client is None:
+        return
+    if not client.push(payload):
+        logger.warning("[WS] Hráč %s nestíhá přijímat zprávy — odpojuji", pid)
+        conn.client = None
+
+
+async def broadcast_payload(room: GameSession, payload: str):
+    get_conn = player_conns.get
     for p in room.players:
-        ws = connected_clients.get(p.player_id)
-        if ws:
-            try:
-                await ws.send_json(message)
-            except Exception:
-                disconnected.append(p.player_id)
-    for pid in disconnected:
-        connected_clients.pop(pid, None)
+        conn = get_conn(p.player_id)
+        if conn:
+            enqueue_payload(p.player_id, conn, payload)
 
 
 async def send_to_player(pid: str, message: dict):
-    ws = connected_clients.get(pid)
-    if ws:
-        try:
-            await ws.send_json(message)
-        except Exception:
-            logger.error(f"Chyba při odesílání zprávy hráči {pid}")
+    conn = player_conns.get(pid)
+    if conn:
+        enqueue_payload(pid, conn, encode_message(message))
 
 
-async def send_lobby_state(room: GameSession):
+def encode_lobby_state(room: GameSession) -> str:
+    """Zakódovaný lobby_state - znovu se staví jen po změně stavu místnosti."""
+    cached = room.lobby_payload_cache
+    if cached and cached[0] == room.state_version:
+        return cached[1]
+    min_players = 1 if room.solo_mode else 2
     can_start = (
-        len(room.players) >= 2
-        and all(p.ready for p in room.players)
-        and room.status == GameStatus.WAITING
-    ) or (
-        room.solo_mode
-        and len(room.players) >= 1
-        and all(p.ready for p in room.players)
-        and room.status == GameStatus.WAITING
+        room.status == GameStatus.WAITING
+        and len(room.players) >= min_players
+        and room.all_ready()
     )
 
-    used_colors = {p.color for p in room.players if p.color}
+    used_colors = room.used_colors()
     available_colors = [c for c in room.COLORS if c not in used_colors]
 
-    await broadcast_to_room(room, {
+    payload = encode_message({
         "type": "lobby_state",
         "room_code": room.room_code,
         "status": room.status.value,
-        "players": [p.to_dict() for p in room.players],
+        "players": room.players_to_dict(),
         "can_start": can_start,
         "available_colors": available_colors,
         "all_colors": room.COLORS,
         "solo_mode": room.solo_mode,
     })
+    room.lobby_payload_cache = (room.state_version, payload)
+    return payload
 
 
-async def send_game_state(room: GameSession):
+async def send_lobby_state(room: GameSession):
+    if not has_connected_players(room):
+        return
+    # Stejný stav už všichni dostali - opakovaný broadcast by nic nezměnil
+    if room.lobby_sent_version == room.state_version:
+        return
+    room.lobby_sent_version = room.state_version
+    await broadcast_payload(room, encode_lobby_state(room))
+
+
+async def send_lobby_state_to_player(pid: str, room: GameSession):
+    conn = player_conns.get(pid)
+    if conn:
+        enqueue_payload(pid, conn, encode_lobby_state(room))
+
+
+def build_game_state(room: GameSession) -> dict:
     state = room.to_dict()
     state["type"] = "game_state"
-    await broadcast_to_room(room, state)
+    return state
+
+
+def encode_game_state(room: GameSession) -> str:
+    """Zakódovaný game_state - znovu se staví jen po změně stavu místnosti."""
+    cached = room.state_payload_cache
+    if cached and cached[0] == room.state_version:
+        return cached[1]
+    payload = encode_message(build_game_state(room))
+    room.state_payload_cache = (room.state_version, payload)
+    return payload
+
+
+def schedule_lobby_flush(room: GameSession):
+    """Naplánuje lobby_state; změny během LOBBY_FLUSH_DELAY odejdou jedním broadcastem."""
+    if room.room_code in lobby_flush_tasks or not has_connected_players(room):
+        return
+    lobby_flush_tasks[room.room_code] = asyncio.create_task(flush_lobby_state(room))
+
+
+async def flush_lobby_state(room: GameSession):
+    try:
+        await asyncio.sleep(LOBBY_FLUSH_DELAY)
+    finally:
+        lobby_flush_tasks.pop(room.room_code, None)
+    if rooms.get(room.room_code) is room and room.status == GameStatus.WAITING:
+        await send_lobby_state(room)
+
+
+async def send_game_state(room: GameSession):
+    if not has_connected_players(room):
+        return
+    await broadcast_payload(room, encode_game_state(room))
+
+
+async def send_turn_update(room: GameSession, events: List[dict]):
+    """Události tahu a nový game_state v jednom rámci místo několika zpráv za sebou."""
+    if not has_connected_players(room):
+        return
+    # Zakódovaný game_state se vkládá přímo - cache podle verze stavu zůstává využitá
+    payload = f'{{"type":"turn_update","events":{orjson.dumps(events).decode()},"state":{encode_game_state(room)}}}'
+    await broadcast_payload(room, payload)
 
 
 async def send_game_state_to_player(pid: str, room: GameSession):
-    state = room.to_dict()
-    state["type"] = "game_state"
-    await send_to_player(pid, state)
+    conn = player_conns.get(pid)
+    if conn:
+        enqueue_payload(pid, conn, encode_game_state(room))
 
 
 # ╔══════════════════════════════════════════════╗
@@ -216,24 +438,46 @@ async def schedule_disconnect_removal(pid: str):
     finally:
         disconnect_tasks.pop(pid, None)
 
-    if pid in connected_clients:
+    if is_connected(pid):
         return
 
     await remove_dead_player(pid)
 
 
+async def cleanup_player(pid: str, client: ClientSocket):
+    """Zpracuje uzavření socketu hráče - oznámí ztrátu spojení a spustí grace period."""
+    detach_socket(pid, client)
+    # Hráč se mezitím mohl vrátit jiným socketem
+    if is_connected(pid):
+        return
+    room = get_player_room(pid)
+    if not room:
+        return
+    p = room.get_player(pid)
+    # V lobby řeší odpojené hráče cleanup (PLAYER_DISCONNECT_TIMEOUT)
+    if not p or room.status != GameStatus.PLAYING:
+        return
+    await broadcast_to_room(room, {
+        "type": "player_connection_lost",
+        "player_id": pid,
+        "player_name": p.name,
+        "message": f"Hráč {p.name} ztratil spojení — {DISCONNECT_GRACE_PERIOD}s na návrat",
+    })
+    old_task = disconnect_tasks.pop(pid, None)
+    if old_task:
+        old_task.cancel()
+    disconnect_tasks[pid] = asyncio.create_task(schedule_disconnect_removal(pid))
+
+
 async def remove_dead_player(pid: str):
     room = get_player_room(pid)
     if not room:
-        player_room.pop(pid, None)
-        player_tokens.pop(pid, None)
-        player_last_activity.pop(pid, None)
-        connected_clients.pop(pid, None)
+        forget_player(pid)
         return
 
     player = room.get_player(pid)
     player_name = player.name if player else "Neznámý"
-    logger.info(f"[CLEANUP] Odstraňuji neaktivního hráče {player_name} ({pid}) z místnosti {room.room_code}")
+    logger.info("[CLEANUP] Odstraňuji neaktivního hráče %s (%s) z místnosti %s", player_name, pid, room.room_code)
 
     was_current = room.current_player_id == pid
     remove_player_from_room(pid, room)
@@ -248,13 +492,7 @@ async def remove_dead_player(pid: str):
                 remove_player_from_room(p.player_id, room)
             reset_room(room)
         elif was_current:
-            nxt = room.get_next_player()
-            if nxt:
-                room.current_player_id = nxt.player_id
-                room.can_roll_dice = True
-                room.last_dice_roll = 0
-                if not has_pieces_on_board(room, nxt):
-                    room.initial_rolls_remaining[nxt.player_id] = 3
+            advance_to_next_player(room)
             await broadcast_to_room(room, {
                 "type": "player_disconnected",
                 "message": f"{player_name} se odpojil — pokračuje další hráč",
@@ -270,61 +508,69 @@ async def remove_dead_player(pid: str):
         await send_lobby_state(room)
 
 
-async def cleanup_task():
-    while True:
-        await asyncio.sleep(CLEANUP_CHECK_INTERVAL)
-        try:
-            now = time.time()
-
-            # Mrtvé hráče (odpojení + timeout)
-            dead = [
-                pid for pid, ts in list(player_last_activity.items())
-                if now - ts > PLAYER_DISCONNECT_TIMEOUT and pid not in connected_clients
-            ]
-            for pid in dead:
-                await remove_dead_player(pid)
-
-            # Neaktivní hry (30 min bez aktivity)
-            inactive = [
-                (code, room) for code, room in list(rooms.items())
-                if room.status == GameStatus.PLAYING
-                and room.players
-                and now - room.last_activity > GAME_INACTIVITY_TIMEOUT
-            ]
-            for code, room in inactive:
-                logger.info(f"[CLEANUP] Místnost {code} ukončena pro neaktivitu ({GAME_INACTIVITY_TIMEOUT}s)")
-                await broadcast_to_room(room, {
-                    "type": "game_reset",
-                    "message": "Hra ukončena — 30 minut bez aktivity",
-                })
-                for p in list(room.players):
-                    remove_player_from_room(p.player_id, room)
-                reset_room(room)
-
-            # Prázdné místnosti
-            empty = [
-                code for code, room in list(rooms.items())
-                if not room.players and now - room.last_activity > EMPTY_ROOM_TIMEOUT
-            ]
-            for code in empty:
-                delete_room(code)
+async def run_cleanup(now: float):
+    # Mrtvé hráče (odpojení + timeout)
+    # Výběr se jen čte - mazání proběhne až po jeho dokončení
+    cutoff = now - PLAYER_DISCONNECT_TIMEOUT
+    dead = [
+        pid for pid, conn in player_conns.items()
+        if conn.client is None and conn.last_activity < cutoff
+    ]
+    for pid in dead:
+        await remove_dead_player(pid)
+
+    # Neaktivní hry (30 min bez aktivity)
+    inactive = [
+        (code, room) for code, room in rooms.items()
+        if room.status == GameStatus.PLAYING
+        and room.players
+        and now - room.last_activity > GAME_INACTIVITY_TIMEOUT
+    ]
+    for code, room in inactive:
+        logger.info("[CLEANUP] Místnost %s ukončena pro neaktivitu (%ss)", code, GAME_INACTIVITY_TIMEOUT)
+        await broadcast_to_room(room, {
+            "type": "game_reset",
+            "message": "Hra ukončena — 30 minut bez aktivity",
+        })
+        for p in list(room.players):
+            remove_player_from_room(p.player_id, room)
+        reset_room(room)
 
-        except Exception as e:
-            logger.error(f"[CLEANUP] Chyba: {e}")
+    # Plné rate-limit buckety (za celé okno se doplní na maximum)
+    stale = [
+        key for key, (_, ts) in rate_limit_state.items()
+        if now - ts >= RATE_LIMIT_WINDOW
+    ]
+    for key in stale:
+        rate_limit_state.pop(key, None)
+
+    # Prázdné místnosti
+    empty = [
+        code for code, room in rooms.items()
+        if not room.players and now - room.last_activity > EMPTY_ROOM_TIMEOUT
+    ]
+    for code in empty:
+        delete_room(code)
+
+
+def ping_clients():
+    for pid, conn in list(player_conns.items()):
+        enqueue_payload(pid, conn, PING_FRAME)
 
 
-async def ping_clients():
+async def maintenance_task():
+    """Jeden periodický task: cleanup každý tick, ping každých WS_PING_INTERVAL."""
+    ping_every = max(1, WS_PING_INTERVAL // CLEANUP_CHECK_INTERVAL)
+    tick = 0
     while True:
-        await asyncio.sleep(WS_PING_INTERVAL)
-        disconnected = []
-        for pid, ws in list(connected_clients.items()):
-            try:
-                await ws.send_json({"type": "ping"})
-            except Exception:
-                disconnected.append(pid)
-        for pid in disconnected:
-            logger.info(f"[PING] Hráč {pid} nereaguje")
-            connected_clients.pop(pid, None)
+        await asyncio.sleep(CLEANUP_CHECK_INTERVAL)
+        tick += 1
+        try:
+            await run_cleanup(time.time())
+        except Exception as e:
+            logger.error("[CLEANUP] Chyba: %s", e)
+        if tick % ping_every == 0:
+            ping_clients()
 
 
 # ╔══════════════════════════════════════════════╗
@@ -333,11 +579,9 @@ async def ping_clients():
 
 @asynccontextmanager
 async def lifespan(_app):
-    t1 = asyncio.create_task(cleanup_task())
-    t2 = asyncio.create_task(ping_clients())
+    task = asyncio.create_task(maintenance_task())
     yield
-    t1.cancel()
-    t2.cancel()
+    task.cancel()
 
 app = FastAPI(title="Online Člověče, nezlob se", docs_url=None, redoc_url=None, lifespan=lifespan)
 
@@ -364,58 +608,63 @@ async def health_check():
 async def websocket_endpoint(websocket: WebSocket):
     client_ip = get_client_ip(websocket)
 
-    if ip_connections[client_ip] >= MAX_CONNECTIONS_PER_IP:
+    if ip_connections.get(client_ip, 0) >= MAX_CONNECTIONS_PER_IP:
         await websocket.close(code=1008, reason="Příliš mnoho spojení")
         return
 
     await websocket.accept()
-    ip_connections[client_ip] += 1
+    ip_connections[client_ip] = ip_connections.get(client_ip, 0) + 1
     player_id = None
+    client = ClientSocket(ws=websocket, out_queue=asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE))
+    client.writer = asyncio.create_task(socket_writer(client))
 
     try:
         while True:
             data = await websocket.receive_text()
+            now = time.time()  # jeden čas pro celou zprávu
 
             if len(data) > MAX_WS_MESSAGE_SIZE:
-                await websocket.send_json({"type": "error", "message": "Zpráva je příliš velká"})
+                await client.send_json({"type": "error", "message": "Zpráva je příliš velká"})
                 continue
 
-            if check_rate_limit(client_ip):
-                await websocket.send_json({"type": "error", "message": "Příliš mnoho požadavků"})
+            if check_rate_limit(client_ip, now):
+                await client.send_json({"type": "error", "message": "Příliš mnoho požadavků"})
                 continue
 
             try:
-                message = json.loads(data)
-            except json.JSONDecodeError:
-                await websocket.send_json({"type": "error", "message": "Neplatný formát zprávy"})
+                message = orjson.loads(data)
+            except orjson.JSONDecodeError:
+                await client.send_json({"type": "error", "message": "Neplatný formát zprávy"})
                 continue
 
             msg_type = message.get("type", "unknown")
 
+            conn = player_conns.get(player_id) if player_id else None
+
             if msg_type == "pong":
-                if player_id:
-                    player_last_activity[player_id] = time.time()
+                if conn:
+                    conn.last_activity = now
                 continue
 
-            if player_id:
-                player_last_activity[player_id] = time.time()
-                room = get_player_room(player_id)
+            if conn:
+                conn.last_activity = now
+                room = rooms.get(conn.room_code)
                 if room:
-                    room.last_activity = time.time()
+                    room.last_activity = now
 
             if msg_type not in ("game_state", "lobby_state", "pong"):
-                logger.info(f"[WS] {player_id or 'anon'}: {msg_type}")
+                logger.info("[WS] %s: %s", player_id or "anon", msg_type)
 
             # ── create_room ───────────────────────────────
             if msg_type == "create_room":
                 name = message.get("name", "").strip()
                 name_error = validate_player_name(name)
                 if name_error:
-                    await websocket.send_json({"type": "error", "message": name_error})
+                    await client.send_json({"type": "error", "message": name_error})
                     continue
 
                 if len(rooms) >= MAX_ROOMS:
-                    await websocket.send_json({"type": "error", "message": "Maximální počet místností dosažen"})
+                    await client.send_json({"type": "error", "message": "Maximální počet místností dosažen"})
                     continue
 
                 solo_mode = message.get("solo_mode", False)
@@ -423,24 +672,21 @@ async def websocket_endpoint(websocket: WebSocket):
                 room = GameSession(room_code=code, solo_mode=solo_mode)
                 rooms[code] = room
 
-                player_id = str(uuid.uuid4())
-                token = str(uuid.uuid4())
+                player_id = new_id()
+                token = new_token()
                 selected_color = room.COLORS[0]
 
-                player = Player(player_id=player_id, name=name, token=token, color=selected_color)
-                room.players.append(player)
-
-                connected_clients[player_id] = websocket
-                player_tokens[player_id] = token
-                player_room[player_id] = code
-                player_last_activity[player_id] = time.time()
-
                 if solo_mode:
                     room.solo_player_id = player_id
 
-                logger.info(f"[ROOM] Vytvořena místnost {code} hráčem {name} (solo={solo_mode})")
+                player = Player(player_id=player_id, name=name, token=token, color=selected_color)
+                room.add_player(player)
+
+                register_player(player_id, token, code, client, now)
+
+                logger.info("[ROOM] Vytvořena místnost %s hráčem %s (solo=%s)", code, name, solo_mode)
 
-                await websocket.send_json({
+                await client.send_json({
                     "type": "joined",
                     "player_id": player_id,
                     "token": token,
@@ -454,53 +700,50 @@ async def websocket_endpoint(websocket: WebSocket):
                 name = message.get("name", "").strip()
                 name_error = validate_player_name(name)
                 if name_error:
-                    await websocket.send_json({"type": "error", "message": name_error})
+                    await client.send_json({"type": "error", "message": name_error})
                     continue
 
                 code = message.get("room_code", "").strip().upper()
                 if not code or len(code) != ROOM_CODE_LENGTH:
-                    await websocket.send_json({"type": "error", "message": "Neplatný kód místnosti"})
+                    await client.send_json({"type": "error", "message": "Neplatný kód místnosti"})
                     continue
 
                 room = rooms.get(code)
                 if not room:
-                    await websocket.send_json({"type": "error", "message": "Místnost nenalezena"})
+                    await client.send_json({"type": "error", "message": "Místnost nenalezena"})
                     continue
 
                 if room.status != GameStatus.WAITING:
-                    await websocket.send_json({"type": "error", "message": "Hra v této místnosti už běží"})
+                    await client.send_json({"type": "error", "message": "Hra v této místnosti už běží"})
                     continue
 
                 if room.solo_mode:
-                    await websocket.send_json({"type": "error", "message": "Místnost je v solo režimu"})
+                    await client.send_json({"type": "error", "message": "Místnost je v solo režimu"})
                     continue
 
                 if len(room.players) >= 4:
-                    await websocket.send_json({"type": "error", "message": "Místnost je plná"})
+                    await client.send_json({"type": "error", "message": "Místnost je plná"})
                     continue
 
-                if any(p.name.lower() == name.lower() for p in room.players):
-                    await websocket.send_json({"type": "error", "message": "Jméno je již obsazené"})
+                if room.has_name(name):
+                    await client.send_json({"type": "error", "message": "Jméno je již obsazené"})
                     continue
 
-                player_id = str(uuid.uuid4())
-                token = str(uuid.uuid4())
+                player_id = new_id()
+                token = new_token()
 
-                used_colors = {p.color for p in room.players if p.color}
+                used_colors = room.used_colors()
                 available = [c for c in room.COLORS if c not in used_colors]
                 selected_color = available[0] if available else room.COLORS[0]
 
                 player = Player(player_id=player_id, name=name, token=token, color=selected_color)
-                room.players.append(player)
+                room.add_player(player)
 
-                connected_clients[player_id] = websocket
-                player_tokens[player_id] = token
-                player_room[player_id] = code
-                player_last_activity[player_id] = time.time()
+                register_player(player_id, token, code, client, now)
 
-                logger.info(f"[JOIN] {name} se připojil do místnosti {code}")
+                logger.info("[JOIN] %s se připojil do místnosti %s", name, code)
 
-                await websocket.send_json({
+                await client.send_json({
                     "type": "joined",
                     "player_id": player_id,
                     "token": token,
@@ -512,36 +755,33 @@ async def websocket_endpoint(websocket: WebSocket):
             # ── reconnect ─────────────────────────────────
             elif msg_type == "reconnect":
                 token = message.get("token")
-                if not token:
-                    await websocket.send_json({"type": "error", "message": "Token je povinný"})
+                if not isinstance(token, str) or not token:
+                    await client.send_json({"type": "error", "message": "Token je povinný"})
                     continue
 
-                player_id = None
-                for pid, t in player_tokens.items():
-                    if t == token:
-                        player_id = pid
-                        break
+                player_id = token_to_player.get(token)
 
                 if not player_id:
-                    await websocket.send_json({"type": "error", "message": "Neplatný token"})
+                    await client.send_json({"type": "error", "message": "Neplatný token"})
                     continue
 
                 room = get_player_room(player_id)
                 if not room:
-                    await websocket.send_json({"type": "error", "message": "Místnost již neexistuje"})
-                    player_tokens.pop(player_id, None)
+                    await client.send_json({"type": "error", "message": "Místnost již neexistuje"})
+                    forget_player(player_id)
                     player_id = None
                     continue
 
-                connected_clients[player_id] = websocket
-                player_last_activity[player_id] = time.time()
+                conn = player_conns[player_id]
+                conn.client = client
+                conn.last_activity = now
 
                 pending = disconnect_tasks.pop(player_id, None)
                 if pending:
                     pending.cancel()
-                    logger.info(f"[RECONNECT] Hráč {player_id} se vrátil — zrušen disconnect timer")
+                    logger.info("[RECONNECT] Hráč %s se vrátil — zrušen disconnect timer", player_id)
 
-                await websocket.send_json({
+                await client.send_json({
                     "type": "reconnected",
                     "player_id": player_id,
                     "room_code": room.room_code,
@@ -557,348 +797,354 @@ async def websocket_endpoint(websocket: WebSocket):
                     })
 
                 if room.status == GameStatus.WAITING:
-                    await send_lobby_state(room)
+                    await send_lobby_state_to_player(player_id, room)
                 else:
                     await send_game_state_to_player(player_id, room)
 
             # ── Ostatní zprávy vyžadují room context ──────
             else:
                 if not player_id:
-                    await websocket.send_json({"type": "error", "message": "Nejste připojeni"})
+                    await client.send_json({"type": "error", "message": "Nejste připojeni"})
                     continue
 
                 room = get_player_room(player_id)
                 if not room:
-                    await websocket.send_json({"type": "error", "message": "Nejste v žádné místnosti"})
+                    await client.send_json({"type": "error", "message": "Nejste v žádné místnosti"})
                     continue
 
-                await handle_room_message(websocket, player_id, room, msg_type, message)
+                await handle_room_message(client, player_id, room, msg_type, message)
 
     except WebSocketDisconnect:
-        logger.info(f"[WS_DISCONNECT] {player_id}")
+        logger.info("[WS_DISCONNECT] %s", player_id)
     except Exception as e:
-        logger.error(f"Chyba v WebSocket: {e}")
+        logger.error("Chyba v WebSocket: %s", e)
     finally:
-        ip_connections[client_ip] = max(0, ip_connections[client_ip] - 1)
+        client.closed = True
+        client.writer.cancel()
+        remaining = ip_connections.get(client_ip, 0) - 1
+        if remaining <= 0:
+            ip_connections.pop(client_ip, None)
+        else:
+            ip_connections[client_ip] = remaining
         if player_id:
-            connected_clients.pop(player_id, None)
-            room = get_player_room(player_id)
-            if room:
-                p = room.get_player(player_id)
-                if p and room.status == GameStatus.PLAYING:
-                    await broadcast_to_room(room, {
-                        "type": "player_connection_lost",
-                        "player_id": player_id,
-                        "player_name": p.name,
-                        "message": f"Hráč {p.name} ztratil spojení — {DISCONNECT_GRACE_PERIOD}s na návrat",
-                    })
-                    old_task = disconnect_tasks.pop(player_id, None)
-                    if old_task:
-                        old_task.cancel()
-                    disconnect_tasks[player_id] = asyncio.create_task(
-                        schedule_disconnect_removal(player_id)
-                    )
+            await cleanup_player(player_id, client)
 
 
 # ╔══════════════════════════════════════════════╗
 # ║  Herní zprávy (v kontextu místnosti)         ║
 # ╚══════════════════════════════════════════════╝
 
-async def handle_room_message(
-    websocket: WebSocket,
-    player_id: str,
-    room: GameSession,
-    msg_type: str,
-    message: dict,
-):
-    # ── select_color ──────────────────────────────
-    if msg_type == "select_color":
-        if room.status != GameStatus.WAITING:
-            await websocket.send_json({"type": "error", "message": "Barvu lze změnit pouze před začátkem hry"})
-            return
-
-        player = room.get_player(player_id)
-        if not player:
-            return
+# ── select_color ──────────────────────────────
+async def handle_select_color(client: ClientSocket, player_id: str, room: GameSession, message: dict):
+    if room.status != GameStatus.WAITING:
+        await client.send_json({"type": "error", "message": "Barvu lze změnit pouze před začátkem hry"})
+        return
 
-        color = message.get("color")
-        if not color or color not in room.COLORS:
-            await websocket.send_json({"type": "error", "message": "Neplatná barva"})
-            return
+    player = room.get_player(player_id)
+    if not player:
+        return
 
-        used = {p.color for p in room.players if p.player_id != player_id and p.color}
-        if color in used:
-            await websocket.send_json({"type": "error", "message": "Tato barva je již obsazena"})
-            return
+    color = message.get("color")
+    if not isinstance(color, str) or color not in room.COLORS_SET:
+        await client.send_json({"type": "error", "message": "Neplatná barva"})
+        return
 
-        player.color = color
-        await send_lobby_state(room)
+    if color != player.color and color in room.used_colors():
+        await client.send_json({"type": "error", "message": "Tato barva je již obsazena"})
+        return
 
-    # ── set_ready ─────────────────────────────────
-    elif msg_type == "set_ready":
-        player = room.get_player(player_id)
-        if not player:
-            return
-        player.ready = message.get("ready", False)
-        await send_lobby_state(room)
+    room.set_player_color(player, color)
+    schedule_lobby_flush(room)
 
-    # ── start_game ────────────────────────────────
-    elif msg_type == "start_game":
-        player = room.get_player(player_id)
-        if room.status != GameStatus.WAITING:
-            await websocket.send_json({"type": "error", "message": "Hra již běží"})
-            return
 
-        if room.solo_mode:
-            if len(room.players) < 1:
-                await websocket.send_json({"type": "error", "message": "Potřebujete alespoň 1 hráče"})
-                return
-            available_colors = room.COLORS.copy()
-            for p in room.players:
-                if p.color and p.color in available_colors:
-                    available_colors.remove(p.color)
-            while len(room.players) < 4 and available_colors:
-                vc = available_colors.pop(0)
-                vp = Player(
-                    player_id=str(uuid.uuid4()),
-                    name=f"Bot {vc.capitalize()}",
-                    token=str(uuid.uuid4()),
-                    color=vc,
-                )
-                vp.ready = True
-                room.players.append(vp)
-        else:
-            if len(room.players) < 2:
-                await websocket.send_json({"type": "error", "message": "Potřebujete alespoň 2 hráče"})
-                return
+# ── set_ready ─────────────────────────────────
+async def handle_set_ready(client: ClientSocket, player_id: str, room: GameSession, message: dict):
+    player = room.get_player(player_id)
+    if not player:
+        return
+    room.set_player_ready(player, bool(message.get("ready", False)))
+    schedule_lobby_flush(room)
 
-        if not all(p.ready for p in room.players):
-            await websocket.send_json({"type": "error", "message": "Všichni hráči musí být ready"})
-            return
 
-        try:
-            initialize_game(room)
-            await broadcast_to_room(room, {
-                "type": "game_started",
-                "message": "Hra začala!",
-                "solo_mode": room.solo_mode,
-            })
-            await send_game_state(room)
-        except Exception as e:
-            logger.error(f"[START_GAME] Chyba: {e}")
-            await websocket.send_json({"type": "error", "message": "Chyba při spuštění hry"})
+# ── start_game ────────────────────────────────
+async def handle_start_game(client: ClientSocket, player_id: str, room: GameSession, message: dict):
+    player = room.get_player(player_id)
+    if room.status != GameStatus.WAITING:
+        await client.send_json({"type": "error", "message": "Hra již běží"})
+        return
 
-    # ── roll_dice ─────────────────────────────────
-    elif msg_type == "roll_dice":
-        if room.status != GameStatus.PLAYING:
-            await websocket.send_json({"type": "error", "message": "Hra neběží"})
+    if room.solo_mode:
+        if len(room.players) < 1:
+            await client.send_json({"type": "error", "message": "Potřebujete alespoň 1 hráče"})
             return
-
-        if room.solo_mode:
-            if room.solo_player_id != player_id:
-                await websocket.send_json({"type": "error", "message": "Není váš tah"})
-                return
-            current_player = room.get_current_player()
-            if not current_player:
-                return
-            player = current_player
-        else:
-            if room.current_player_id != player_id:
-                await websocket.send_json({"type": "error", "message": "Není váš tah"})
-                return
-            player = room.get_player(player_id)
-            if not player:
-                return
-
-        if not room.can_roll_dice:
-            await websocket.send_json({"type": "error", "message": "Nemůžete házet kostkou"})
+        used_colors = room.used_colors()
+        available_colors = [c for c in room.COLORS if c not in used_colors]
+        needed = max(0, 4 - len(room.players))
+        room.add_players([acquire_bot(vc) for vc in available_colors[:needed]])
+    else:
+        if len(room.players) < 2:
+            await client.send_json({"type": "error", "message": "Potřebujete alespoň 2 hráče"})
             return
 
-        dice_value = roll_dice()
-        room.last_dice_roll = dice_value
-
-        if dice_value == 6:
-            player.stats_sixes += 1
-
-        has_on_board = has_pieces_on_board(room, player)
-        current_pid = player.player_id if not room.solo_mode else room.current_player_id
-        can_move_ids = get_can_move_pawn_ids(room, player, dice_value)
-        has_valid = len(can_move_ids) > 0
-
-        if dice_value == 6:
-            if not has_valid:
-                end_turn(room, dice_value, after_move=False)
-            else:
-                room.can_roll_dice = False
-        elif has_on_board:
-            if not has_valid:
-                end_turn(room, dice_value, after_move=False)
-            else:
-                room.can_roll_dice = False
-        else:
-            initial = room.initial_rolls_remaining.get(current_pid, 0)
-            if initial > 0:
-                room.initial_rolls_remaining[current_pid] = initial - 1
-                room.can_roll_dice = True
-            else:
-                room.can_roll_dice = False
-                end_turn(room, dice_value, after_move=False)
+    if not room.all_ready():
+        await client.send_json({"type": "error", "message": "Všichni hráči musí být ready"})
+        return
 
+    try:
+        initialize_game(room)
         await broadcast_to_room(room, {
-            "type": "dice_rolled",
-            "player_id": current_pid,
-            "player_name": player.name,
-            "dice_roll": dice_value,
+            "type": "game_started",
+            "message": "Hra začala!",
+            "solo_mode": room.solo_mode,
         })
         await send_game_state(room)
+    except Exception as e:
+        logger.error("[START_GAME] Chyba: %s", e)
+        await client.send_json({"type": "error", "message": "Chyba při spuštění hry"})
 
-    # ── move_piece ────────────────────────────────
-    elif msg_type == "move_piece":
-        if room.status != GameStatus.PLAYING:
-            await websocket.send_json({"type": "error", "message": "Hra neběží"})
-            return
-
-        if room.solo_mode:
-            if room.solo_player_id != player_id:
-                await websocket.send_json({"type": "error", "message": "Není váš tah"})
-                return
-        else:
-            if room.current_player_id != player_id:
-                await websocket.send_json({"type": "error", "message": "Není váš tah"})
-                return
 
-        if room.can_roll_dice:
-            await websocket.send_json({"type": "error", "message": "Nejdříve hoďte kostkou"})
-            return
+# ── roll_dice ─────────────────────────────────
+async def handle_roll_dice(client: ClientSocket, player_id: str, room: GameSession, message: dict):
+    if room.status != GameStatus.PLAYING:
+        await client.send_json({"type": "error", "message": "Hra neběží"})
+        return
 
-        piece_id = message.get("piece_id")
-        if not piece_id:
-            await websocket.send_json({"type": "error", "message": "piece_id je povinný"})
+    if room.solo_mode:
+        if room.solo_player_id != player_id:
+            await client.send_json({"type": "error", "message": "Není váš tah"})
             return
-
         current_player = room.get_current_player()
         if not current_player:
             return
-
-        player = current_player if room.solo_mode else room.get_player(player_id)
+        player = current_player
+    else:
+        if room.current_player_id != player_id:
+            await client.send_json({"type": "error", "message": "Není váš tah"})
+            return
+        player = room.get_player(player_id)
         if not player:
             return
 
-        piece = next((p for p in player.pieces if p.piece_id == piece_id), None)
-        if not piece:
-            await websocket.send_json({"type": "error", "message": "Figurka nenalezena"})
-            return
+    if not room.can_roll_dice:
+        await client.send_json({"type": "error", "message": "Nemůžete házet kostkou"})
+        return
 
-        if not can_move_piece(room, player, piece, room.last_dice_roll):
-            await websocket.send_json({"type": "error", "message": "Nelze pohnout figurkou"})
-            return
+    dice_value = roll_dice()
+    room.last_dice_roll = dice_value
 
-        try:
-            result = move_piece(room, player, piece, room.last_dice_roll)
-            await broadcast_to_room(room, {
-                "type": "piece_moved",
-                "player_id": player_id,
-                "player_name": player.name,
-                "result": result,
-            })
+    if dice_value == 6:
+        player.stats_sixes += 1
 
-            winner_id = check_game_end(room)
-            if winner_id:
-                winner = room.get_player(winner_id)
-                await broadcast_to_room(room, {
-                    "type": "game_end",
-                    "winner_id": winner_id,
-                    "winner_name": winner.name,
-                })
-            else:
-                end_turn(room, room.last_dice_roll, after_move=True)
+    current_pid = player.player_id if not room.solo_mode else room.current_player_id
+    opts = compute_turn_options(room, player, dice_value)
+    has_valid = bool(opts.movable_ids)
 
-            await send_game_state(room)
-        except Exception as e:
-            logger.error(f"[MOVE] Chyba: {e}")
-            await websocket.send_json({"type": "error", "message": "Nelze pohnout figurkou"})
+    if dice_value == 6:
+        if not has_valid:
+            end_turn(room, dice_value, after_move=False)
+        else:
+            room.can_roll_dice = False
+    elif opts.has_on_board:
+        if not has_valid:
+            end_turn(room, dice_value, after_move=False)
+        else:
+            room.can_roll_dice = False
+    else:
+        if opts.initial_rolls > 0:
+            room.initial_rolls_remaining[current_pid] = opts.initial_rolls - 1
+            room.can_roll_dice = True
+        else:
+            room.can_roll_dice = False
+            end_turn(room, dice_value, after_move=False)
+    room.bump()
+    room.current_turn_moves = (room.state_version, set(opts.movable_ids))
+
+    await send_turn_update(room, [{
+        "type": "dice_rolled",
+        "player_id": current_pid,
+        "player_name": player.name,
+        "dice_roll": dice_value,
+    }])
+
+
+# ── move_piece ────────────────────────────────
+async def handle_move_piece(client: ClientSocket, player_id: str, room: GameSession, message: dict):
+    if room.status != GameStatus.PLAYING:
+        await client.send_json({"type": "error", "message": "Hra neběží"})
+        return
 
-    # ── skip_turn ─────────────────────────────────
-    elif msg_type == "skip_turn":
-        if room.status != GameStatus.PLAYING:
+    if room.solo_mode:
+        if room.solo_player_id != player_id:
+            await client.send_json({"type": "error", "message": "Není váš tah"})
+            return
+    else:
+        if room.current_player_id != player_id:
+            await client.send_json({"type": "error", "message": "Není váš tah"})
             return
 
-        if room.solo_mode:
-            if room.solo_player_id != player_id:
-                return
-        else:
-            if room.current_player_id != player_id:
-                return
+    if room.can_roll_dice:
+        await client.send_json({"type": "error", "message": "Nejdříve hoďte kostkou"})
+        return
 
-        if room.can_roll_dice:
-            await websocket.send_json({"type": "error", "message": "Nejdříve hoďte kostkou"})
-            return
+    piece_id = message.get("piece_id")
+    if not piece_id or not isinstance(piece_id, str):
+        await client.send_json({"type": "error", "message": "piece_id je povinný"})
+        return
 
-        cp = room.get_current_player()
-        end_turn(room, room.last_dice_roll)
-        await broadcast_to_room(room, {
-            "type": "turn_skipped",
-            "player_id": cp.player_id if cp else player_id,
-            "player_name": cp.name if cp else "unknown",
-        })
-        await send_game_state(room)
+    current_player = room.get_current_player()
+    if not current_player:
+        return
+
+    player = current_player if room.solo_mode else room.get_player(player_id)
+    if not player:
+        return
 
-    # ── leave_lobby ───────────────────────────────
-    elif msg_type == "leave_lobby":
-        remove_player_from_room(player_id, room)
+    piece = player.get_piece(piece_id)
+    if not piece:
+        await client.send_json({"type": "error", "message": "Figurka nenalezena"})
+        return
 
-        if room.status == GameStatus.WAITING:
-            if room.players:
-                await send_lobby_state(room)
-            else:
-                delete_room(room.room_code)
-        elif len(room.players) < 2 and not room.solo_mode:
-            reset_room(room)
-            room.players = []
-            await broadcast_to_room(room, {
-                "type": "game_reset",
-                "message": "Hra byla resetována — příliš málo hráčů",
+    turn_moves = room.current_turn_moves
+    if turn_moves and turn_moves[0] == room.state_version:
+        legal = piece_id in turn_moves[1]
+    else:
+        legal = can_move_piece(room, player, piece, room.last_dice_roll)
+    if not legal:
+        await client.send_json({"type": "error", "message": "Nelze pohnout figurkou"})
+        return
+
+    try:
+        result = move_piece(room, player, piece, room.last_dice_roll)
+        events = [{
+            "type": "piece_moved",
+            "player_id": player_id,
+            "player_name": player.name,
+            "result": result,
+        }]
+
+        winner_id = check_game_end(room)
+        if winner_id:
+            winner = room.get_player(winner_id)
+            events.append({
+                "type": "game_end",
+                "winner_id": winner_id,
+                "winner_name": winner.name,
             })
-            delete_room(room.room_code)
+        else:
+            end_turn(room, room.last_dice_roll, after_move=True)
 
-    # ── end_solo_game ─────────────────────────────
-    elif msg_type == "end_solo_game":
-        if not room.solo_mode or room.solo_player_id != player_id:
-            await websocket.send_json({"type": "error", "message": "Tuto akci lze provést pouze v solo režimu"})
-            return
+        await send_turn_update(room, events)
+    except Exception as e:
+        logger.error("[MOVE] Chyba: %s", e)
+        await client.send_json({"type": "error", "message": "Nelze pohnout figurkou"})
 
-        code = room.room_code
-        await websocket.send_json({"type": "solo_game_ended", "message": "Hra byla ukončena"})
-        delete_room(code)
 
-    # ── new_game ──────────────────────────────────
-    elif msg_type == "new_game":
-        if room.status != GameStatus.FINISHED:
-            await websocket.send_json({"type": "error", "message": "Hra ještě neskončila"})
+# ── skip_turn ─────────────────────────────────
+async def handle_skip_turn(client: ClientSocket, player_id: str, room: GameSession, message: dict):
+    if room.status != GameStatus.PLAYING:
+        return
+
+    if room.solo_mode:
+        if room.solo_player_id != player_id:
+            return
+    else:
+        if room.current_player_id != player_id:
             return
 
-        was_solo = room.solo_mode
-        reset_room(room)
+    if room.can_roll_dice:
+        await client.send_json({"type": "error", "message": "Nejdříve hoďte kostkou"})
+        return
 
-        if was_solo:
-            room.players = [p for p in room.players if p.player_id in player_tokens]
+    cp = room.get_current_player()
+    end_turn(room, room.last_dice_roll)
+    await send_turn_update(room, [{
+        "type": "turn_skipped",
+        "player_id": cp.player_id if cp else player_id,
+        "player_name": cp.name if cp else "unknown",
+    }])
 
-        for p in room.players:
-            p.ready = False
-            p.stats_turns = 0
-            p.stats_deployments = 0
-            p.stats_moves = 0
-            p.stats_captures = 0
-            p.stats_sixes = 0
-            for piece in p.pieces:
-                piece.status = PieceStatus.HOME
-                piece.position = piece.home_position
 
+# ── leave_lobby ───────────────────────────────
+async def handle_leave_lobby(client: ClientSocket, player_id: str, room: GameSession, message: dict):
+    remove_player_from_room(player_id, room)
+
+    if room.status == GameStatus.WAITING:
+        if room.players:
+            schedule_lobby_flush(room)
+        else:
+            delete_room(room.room_code)
+    elif len(room.players) < 2 and not room.solo_mode:
+        reset_room(room)
+        room.players = []
+        room.index_players()
         await broadcast_to_room(room, {
-            "type": "return_to_lobby",
-            "message": "Nová hra — vracíme se do lobby",
+            "type": "game_reset",
+            "message": "Hra byla resetována — příliš málo hráčů",
         })
-        await send_lobby_state(room)
+        delete_room(room.room_code)
 
-    else:
-        await websocket.send_json({"type": "error", "message": f"Neznámý typ zprávy: {msg_type}"})
+
+# ── end_solo_game ─────────────────────────────
+async def handle_end_solo_game(client: ClientSocket, player_id: str, room: GameSession, message: dict):
+    if not room.solo_mode or room.solo_player_id != player_id:
+        await client.send_json({"type": "error", "message": "Tuto akci lze provést pouze v solo režimu"})
+        return
+
+    code = room.room_code
+    await client.send_json({"type": "solo_game_ended", "message": "Hra byla ukončena"})
+    delete_room(code)
+
+
+# ── new_game ──────────────────────────────────
+async def handle_new_game(client: ClientSocket, player_id: str, room: GameSession, message: dict):
+    if room.status != GameStatus.FINISHED:
+        await client.send_json({"type": "error", "message": "Hra ještě neskončila"})
+        return
+
+    was_solo = room.solo_mode
+    reset_room(room)
+
+    if was_solo:
+        # Boti nemají spojení - uvolní se do poolu, seznam se mění jen pokud nějaký byl
+        humans = []
+        for p in room.players:
+            if p.player_id in player_conns:
+                humans.append(p)
+            else:
+                release_bot(p)
+        if len(humans) != len(room.players):
+            room.players[:] = humans
+            room.index_players()
+
+    await broadcast_to_room(room, {
+        "type": "return_to_lobby",
+        "message": "Nová hra — vracíme se do lobby",
+    })
+    await send_lobby_state(room)
+
+
+ROOM_HANDLERS = {
+    "select_color": handle_select_color,
+    "set_ready": handle_set_ready,
+    "start_game": handle_start_game,
+    "roll_dice": handle_roll_dice,
+    "move_piece": handle_move_piece,
+    "skip_turn": handle_skip_turn,
+    "leave_lobby": handle_leave_lobby,
+    "end_solo_game": handle_end_solo_game,
+    "new_game": handle_new_game,
+}
+
+
+async def handle_room_message(
+    client: ClientSocket,
+    player_id: str,
+    room: GameSession,
+    msg_type: str,
+    message: dict,
+):
+    handler = ROOM_HANDLERS.get(msg_type)
+    if handler is None:
+        await client.send_json({"type": "error", "message": f"Neznámý typ zprávy: {msg_type}"})
+        return
+    await handler(client, player_id, room, message)
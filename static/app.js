@@ -282,6 +282,12 @@ function handleMessage(message) {
             updateGame(message);
             break;
 
+        case "turn_update":
+            // Události tahu a následný game_state v jednom rámci - zpracují se ve stejném pořadí
+            message.events.forEach(handleMessage);
+            handleMessage(message.state);
+            break;
+
         case "dice_rolled": {
             const cp = currentGameState?.players?.find(p => p.player_id === currentGameState?.current_player_id);
             updateDice(message.dice_roll, cp?.color || null);
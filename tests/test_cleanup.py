@@ -0,0 +1,53 @@
+import asyncio
+import unittest
+
+import main
+from app.models import GameSession, Player
+
+
+class RunCleanupTest(unittest.IsolatedAsyncioTestCase):
+    """Regrese: cleanup pass musí projít s registrovaným PlayerConn"""
+
+    def setUp(self):
+        main.rooms.clear()
+        main.player_conns.clear()
+        main.token_to_player.clear()
+        main.rate_limit_state.clear()
+
+    tearDown = setUp
+
+    def add_player(self, room: GameSession, pid: str, last_activity: float, client=None):
+        room.add_player(Player(player_id=pid, name=pid, token=f"t-{pid}"))
+        main.register_player(pid, f"t-{pid}", room.room_code, client, last_activity)
+
+    async def test_removes_stale_disconnected_player(self):
+        now = 10_000.0
+        room = GameSession(room_code="ABCD")
+        main.rooms[room.room_code] = room
+        self.add_player(room, "gone", now - main.PLAYER_DISCONNECT_TIMEOUT - 1)
+        client = main.ClientSocket(ws=None, out_queue=asyncio.Queue())
+        self.add_player(room, "alive", now - main.PLAYER_DISCONNECT_TIMEOUT - 1, client)
+        main.rate_limit_state["1.2.3.4"] = (0.0, now - main.RATE_LIMIT_WINDOW)
+
+        await main.run_cleanup(now)
+
+        self.assertNotIn("gone", main.player_conns)
+        self.assertIsNone(room.get_player("gone"))
+        self.assertIn("alive", main.player_conns)
+        self.assertNotIn("1.2.3.4", main.rate_limit_state)
+
+    async def test_deletes_empty_room(self):
+        now = 10_000.0
+        room = GameSession(room_code="WXYZ")
+        room.last_activity = now - main.EMPTY_ROOM_TIMEOUT - 1
+        main.rooms[room.room_code] = room
+        self.add_player(main.rooms.setdefault("KEEP", GameSession(room_code="KEEP")), "p", now)
+
+        await main.run_cleanup(now)
+
+        self.assertNotIn("WXYZ", main.rooms)
+        self.assertIn("KEEP", main.rooms)
+
+
+if __name__ == "__main__":
+    unittest.main()
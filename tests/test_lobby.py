@@ -0,0 +1,41 @@
+import asyncio
+import unittest
+
+import main
+from app.models import GameSession, Player
+
+
+class LobbyStateDedupTest(unittest.IsolatedAsyncioTestCase):
+    """Regrese: opakované set_ready/select_color bez změny nesmí poslat další lobby_state"""
+
+    def setUp(self):
+        main.rooms.clear()
+        main.player_conns.clear()
+        main.token_to_player.clear()
+
+    tearDown = setUp
+
+    async def test_repeated_noop_changes_send_nothing(self):
+        room = GameSession(room_code="ABCD")
+        main.rooms[room.room_code] = room
+        player = Player(player_id="p", name="p", token="t-p")
+        room.add_player(player)
+        client = main.ClientSocket(ws=None, out_queue=asyncio.Queue())
+        main.register_player("p", "t-p", room.room_code, client, 0.0)
+
+        room.set_player_color(player, room.COLORS[0])
+        room.set_player_ready(player, True)
+        await main.send_lobby_state(room)
+        version = room.state_version
+
+        for _ in range(3):
+            room.set_player_ready(player, True)
+        room.set_player_color(player, room.COLORS[0])
+        await main.send_lobby_state(room)
+
+        self.assertEqual(room.state_version, version)
+        self.assertEqual(client.out_queue.qsize(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()